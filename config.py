@@ -29,7 +29,8 @@ if db_url.drivername == "postgresql":
 engine = create_engine(
     db_url,
     echo=SQLALCHEMY_ECHO,
-    pool_pre_ping=True,   # check connection before using
+    pool_pre_ping=False,  # no SELECT 1 per checkout; callers retry on a stale connection
+    pool_recycle=1800,    # replace connections before Neon's idle timeout drops them
 )
 
 # --- Session factory ---
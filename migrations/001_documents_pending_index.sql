@@ -0,0 +1,23 @@
+-- 001_documents_pending_index.sql
+-- --------------------------------
+-- Partial index for process_pdfs.fetch_batch.
+--
+-- Only rows still waiting to be processed are indexed, so the index tracks
+-- the backlog rather than the whole table: finding a batch to claim costs
+-- proportional to the batch, not to the table. fetch_batch locks the rows it
+-- returns (FOR UPDATE), which always needs the heap tuple, so this is a plain
+-- index scan — covering columns (INCLUDE) would only make the index bigger.
+--
+-- The predicate must match fetch_batch's WHERE clause for the planner to use
+-- it: the literal 5 below has to equal MAX_ATTEMPTS (fetch_batch inlines it
+-- as a literal for the same reason). If you change MAX_ATTEMPTS, drop and
+-- recreate this index with the new value.
+--
+-- CONCURRENTLY cannot run inside a transaction block; run this file with
+-- psql (autocommit), not through engine.begin().
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS documents_pending_idx
+    ON dev.documents (id)
+    WHERE processed IS DISTINCT FROM TRUE
+      AND pdf_url IS NOT NULL
+      AND process_attempts < 5;
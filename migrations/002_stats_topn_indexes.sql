@@ -0,0 +1,19 @@
+-- 002_stats_topn_indexes.sql
+-- --------------------------
+-- Partial indexes for the two top-10 lists in stats.py, so each becomes a
+-- short index scan instead of a full scan + sort.
+--
+-- "Recent errors": ORDER BY processed_at DESC NULLS LAST over rows with
+-- last_error set. The index order must match the ORDER BY exactly.
+--
+-- "Oldest unprocessed": ORDER BY id over rows with processed = FALSE.
+--
+-- As with 001, run with psql: CONCURRENTLY cannot run inside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS documents_recent_errors_idx
+    ON dev.documents (processed_at DESC NULLS LAST)
+    WHERE last_error IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS documents_unprocessed_idx
+    ON dev.documents (id)
+    WHERE processed = FALSE;
@@ -0,0 +1,16 @@
+-- 003_documents_fillfactor.sql
+-- ----------------------------
+-- Leave 20% free space on each heap page of dev.documents.
+--
+-- The worker's updates are not HOT. A success flips processed, and a failure
+-- bumps process_attempts and sets last_error. All three are predicate columns
+-- of the partial indexes (see 001/002), so every update writes index entries.
+-- What remains is locality. Postgres puts the new row version on the old
+-- row's page when there is room, so an update dirties one heap page instead
+-- of two, and the table grows less between vacuums. The cost is a heap that
+-- is about 20% larger for rows that are never updated again.
+--
+-- Only pages written after this change use the new setting; existing pages
+-- are repacked by VACUUM FULL (locks the table) or pg_repack.
+
+ALTER TABLE dev.documents SET (fillfactor = 80);
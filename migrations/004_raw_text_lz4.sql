@@ -0,0 +1,24 @@
+-- 004_raw_text_lz4.sql
+-- --------------------
+-- Compress raw_text with LZ4 instead of the default pglz (Postgres 14+,
+-- server built with lz4 — Neon is).
+--
+-- raw_text is by far the largest column. LZ4 compresses and decompresses
+-- much faster than pglz at a similar ratio, which cuts CPU on every write
+-- from the worker and every read that touches the text. Smaller TOAST chunks
+-- also mean fewer page fetches from Neon's remote storage.
+--
+-- This is a catalog-only change and returns immediately: new and updated
+-- values use LZ4, existing values keep pglz until their value is rewritten.
+-- VACUUM FULL / CLUSTER do NOT convert them (they copy compressed datums
+-- as-is), and a plain `SET raw_text = raw_text` keeps the old datum too.
+-- To convert old rows, rewrite them in chunks, repeating until 0 rows:
+--   UPDATE dev.documents SET raw_text = raw_text || ''
+--   WHERE id IN (
+--     SELECT id FROM dev.documents
+--     WHERE raw_text IS NOT NULL
+--       AND pg_column_compression(raw_text) = 'pglz'
+--     LIMIT 1000
+--   );
+
+ALTER TABLE dev.documents ALTER COLUMN raw_text SET COMPRESSION lz4;
@@ -3,7 +3,7 @@ process_pdfs.py
 ---------------
 Processes a batch of PDF URLs from dev.documents:
   - downloads each PDF
-  - extracts text with pypdf
+  - extracts text with PyMuPDF
   - writes raw_text and status fields back to Postgres
 
 Table columns used:
@@ -30,27 +30,35 @@ Env vars (optional):
   HTTP_USER_AGENT=Remedy-PDF-Processor/1.0
   DOCS_TABLE=dev.documents
   MAX_ATTEMPTS=5
+  DOWNLOAD_CONCURRENCY=64
+  EXTRACT_WORKERS=<cpu count>
 """
 
 from __future__ import annotations
 
 import os
-import io
 import re
 import time
+import asyncio
 import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator
 from urllib.parse import urlparse, unquote
 
 import load_env  # noqa: F401
+import psycopg
 from config import engine
 from sqlalchemy import text
-from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from pypdf import PdfReader
-from pypdf.errors import PdfReadError
+import httpx
+import pymupdf
 
 
 # --------- Settings ---------
@@ -62,25 +70,77 @@ RETRY_TOTAL = int(os.getenv("REQUEST_RETRY_TOTAL", "3"))
 RETRY_BACKOFF = float(os.getenv("REQUEST_RETRY_BACKOFF", "0.5"))
 USER_AGENT = os.getenv("HTTP_USER_AGENT", "Remedy-PDF-Processor/1.0 (+neon)")
 MAX_ATTEMPTS = int(os.getenv("MAX_ATTEMPTS", "5"))
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "64"))
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+SPOOL_MAX_BYTES = 8 * 1024 * 1024  # downloads larger than this spill to a temp file
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+PAGE_SPLIT_THRESHOLD = 32  # PDFs with more pages are extracted across several workers
+MAX_PDF_BYTES = int(MAX_PDF_MB * 1024 * 1024)
+
+FILENAME_RE = re.compile(r'filename\*?=(?:UTF-8\'\')?"?([^\";]+)"?', re.I)
+# Joined between pages; identical to the sentinel plus the "\n" joins of earlier output
+PDF_BREAK = "\n\n\n----- PAGE BREAK -----\n\n\n"
 
 
 # --------- HTTP client with retries ---------
-def make_http_session() -> requests.Session:
-    sess = requests.Session()
-    retry = Retry(
-        total=RETRY_TOTAL,
-        connect=RETRY_TOTAL,
-        read=RETRY_TOTAL,
-        backoff_factor=RETRY_BACKOFF,
-        status_forcelist=(429, 500, 502, 503, 504),
-        allowed_methods=frozenset(["GET", "HEAD"]),
-        raise_on_status=False,
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_AFTER_STATUSES = frozenset({429, 503})
+# The transport already retries failed connects; retrying these would not help
+NO_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.UnsupportedProtocol)
+
+
+def make_http_client() -> httpx.AsyncClient:
+    """
+    Async HTTP/2 client so downloads from the same origin share one TLS connection.
+    The transport's retries only cover failed connects; retryable status
+    codes are handled by stream_get, and dropped or timed-out transfers by
+    download_pdf.
+    """
+    limits = httpx.Limits(
+        max_connections=DOWNLOAD_CONCURRENCY, max_keepalive_connections=DOWNLOAD_CONCURRENCY
     )
-    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=20)
-    sess.mount("http://", adapter)
-    sess.mount("https://", adapter)
-    sess.headers.update({"User-Agent": USER_AGENT})
-    return sess
+    return httpx.AsyncClient(
+        timeout=REQUEST_TIMEOUT,
+        follow_redirects=True,
+        headers={"User-Agent": USER_AGENT},
+        transport=httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=RETRY_TOTAL),
+    )
+
+
+@asynccontextmanager
+async def stream_get(client: httpx.AsyncClient, url: str) -> AsyncIterator[httpx.Response]:
+    """
+    Streaming GET that retries RETRY_STATUSES, waiting as retry_delay says.
+    The last response is yielded as-is once retries run out.
+    """
+    for attempt in range(RETRY_TOTAL + 1):
+        async with client.stream("GET", url) as r:
+            if r.status_code not in RETRY_STATUSES or attempt == RETRY_TOTAL:
+                yield r
+                return
+            delay = retry_delay(attempt, r)
+        await asyncio.sleep(delay)
+
+
+def retry_delay(attempt: int, r: httpx.Response | None = None) -> float:
+    """
+    Seconds to wait before the next retry: the server's Retry-After on
+    429/503 when it is present and parseable (seconds or an HTTP date),
+    otherwise exponential backoff.
+    """
+    if r is not None and r.status_code in RETRY_AFTER_STATUSES:
+        retry_after = r.headers.get("Retry-After", "").strip()
+        if retry_after.isdigit():
+            return float(retry_after)
+        try:
+            when = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            pass
+        else:
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=timezone.utc)
+            return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    return RETRY_BACKOFF * (2 ** attempt)
 
 
 # --------- Helpers ---------
@@ -88,27 +148,57 @@ def fetch_batch(conn):
     """
     Lock a batch of rows that still need processing.
     Uses SKIP LOCKED so multiple workers can run safely in parallel.
+    No ORDER BY: claim order doesn't matter, and leaving it out lets Postgres
+    stop after the first :batch matching rows instead of sorting the backlog.
+    MAX_ATTEMPTS is inlined as a literal (it's an int, so safe) so that even a
+    prepared generic plan can match the partial index from migration 001.
     """
     sql = f"""
         SELECT id, pdf_url
         FROM {TABLE}
         WHERE processed IS DISTINCT FROM TRUE
           AND pdf_url IS NOT NULL
-          AND process_attempts < :max_attempts
-        ORDER BY id
+          AND process_attempts < {int(MAX_ATTEMPTS)}
         FOR UPDATE SKIP LOCKED
         LIMIT :batch
     """
-    return conn.execute(
-        text(sql), {"batch": BATCH_SIZE, "max_attempts": MAX_ATTEMPTS}
-    ).fetchall()
+    return conn.execute(text(sql), {"batch": BATCH_SIZE}).fetchall()
+
+
+def load_known_shas(conn) -> set[str]:
+    """
+    Digests of PDFs already stored, so a duplicate download can be rejected
+    before extraction instead of failing on the sha256 UNIQUE constraint.
+    Only processed rows count: unprocessed rows may still hold placeholder digests.
+    """
+    sql = f"""
+        SELECT sha256
+        FROM {TABLE}
+        WHERE processed = TRUE
+          AND sha256 IS NOT NULL
+    """
+    return set(conn.execute(text(sql)).scalars())
+
+
+KNOWN_SHAS: set[str] | None = None
+
+
+def get_known_shas(conn) -> set[str]:
+    """
+    The known digest set, loaded on first use so a run that finds nothing
+    to process never scans the table. Batches add to it as they commit.
+    """
+    global KNOWN_SHAS
+    if KNOWN_SHAS is None:
+        KNOWN_SHAS = load_known_shas(conn)
+    return KNOWN_SHAS
 
 
 def guess_filename(url: str, content_disposition: str | None) -> str | None:
     # Try Content-Disposition first
     if content_disposition:
         # e.g., attachment; filename="doc.pdf"
-        m = re.search(r'filename\*?=(?:UTF-8\'\')?"?([^\";]+)"?', content_disposition, flags=re.I)
+        m = FILENAME_RE.search(content_disposition)
         if m:
             return unquote(m.group(1)).strip()
     # Fallback to URL path
@@ -119,95 +209,213 @@ def guess_filename(url: str, content_disposition: str | None) -> str | None:
     return None
 
 
-def download_pdf(sess: requests.Session, url: str) -> tuple[bytes, dict]:
+async def download_pdf(client: httpx.AsyncClient, url: str) -> tuple[bytes | str, str, dict]:
+    """
+    Download a PDF, starting over with exponential backoff when the transfer
+    fails (read timeouts, dropped connections, protocol errors) at any point,
+    including mid-body. See fetch_pdf for the result.
+    """
+    for attempt in range(RETRY_TOTAL):
+        try:
+            return await fetch_pdf(client, url)
+        except httpx.TransportError as exc:
+            if isinstance(exc, NO_RETRY_ERRORS):
+                raise
+        await asyncio.sleep(retry_delay(attempt))
+    return await fetch_pdf(client, url)
+
+
+async def fetch_pdf(client: httpx.AsyncClient, url: str) -> tuple[bytes | str, str, dict]:
     """
     Download PDF with size cap and basic metadata return.
-    Returns (bytes, meta) where meta includes mime, filename, content_length, headers.
+    The body is hashed while it streams. PDFs up to SPOOL_MAX_BYTES are kept
+    in memory; larger ones spill to a named temp file so extraction workers
+    can open them by path instead of receiving the bytes over IPC.
+    Returns (pdf, sha256 hex, meta) where pdf is the bytes or the temp file
+    path, and meta includes mime, filename, content_length, headers.
+    The caller must discard_pdf() the result.
     """
     meta = {"mime": None, "filename": None, "content_length": None, "headers": {}}
 
-    # HEAD (best-effort)
-    try:
-        h = sess.head(url, timeout=REQUEST_TIMEOUT, allow_redirects=True)
-        meta["headers"] = dict(h.headers)
-        meta["mime"] = h.headers.get("Content-Type")
-        cl = h.headers.get("Content-Length")
-        if cl and cl.isdigit():
-            meta["content_length"] = int(cl)
-            mb = int(cl) / (1024 * 1024)
-            if mb > MAX_PDF_MB:
-                raise ValueError(f"PDF too large (HEAD): ~{mb:.1f} MB > {MAX_PDF_MB} MB")
-        meta["filename"] = guess_filename(url, h.headers.get("Content-Disposition"))
-    except Exception:
-        # Proceed regardless; some servers don’t support HEAD well
-        pass
-
-    with sess.get(url, timeout=REQUEST_TIMEOUT, stream=True) as r:
+    async with stream_get(client, url) as r:
         r.raise_for_status()
 
-        # If HEAD didn't give filename, try GET headers
-        if not meta["filename"]:
-            meta["filename"] = guess_filename(url, r.headers.get("Content-Disposition"))
-        # Prefer GET content-type
-        meta["mime"] = r.headers.get("Content-Type") or meta["mime"]
+        meta["headers"] = dict(r.headers)
+        meta["filename"] = guess_filename(url, r.headers.get("Content-Disposition"))
+        meta["mime"] = r.headers.get("Content-Type")
 
         if meta["mime"] and "pdf" not in meta["mime"].lower():
             raise ValueError(f"Unexpected content-type: {meta['mime']}")
 
-        cap = int(MAX_PDF_MB * 1024 * 1024)
-        buf = io.BytesIO()
+        # Reject declared oversize bodies up front; the streaming cap below
+        # still catches servers that omit or understate Content-Length.
+        cl = r.headers.get("Content-Length")
+        if cl and cl.isdigit():
+            mb = int(cl) / (1024 * 1024)
+            if mb > MAX_PDF_MB:
+                raise ValueError(f"PDF too large: ~{mb:.1f} MB > {MAX_PDF_MB} MB")
+
+        # The only pass over the bytes for hashing: OpenSSL-backed hashlib already
+        # uses SHA-NI where the CPU has it, so a separate file_digest() pass would
+        # only add work. sha256 stays because the column and UNIQUE key depend on it.
+        hasher = hashlib.sha256()
+        chunks = []
+        spill = None
         read = 0
-        for chunk in r.iter_content(chunk_size=1024 * 64):
-            if not chunk:
-                continue
-            buf.write(chunk)
-            read += len(chunk)
-            if read > cap:
-                raise ValueError(f"PDF too large (GET): exceeded {MAX_PDF_MB} MB cap")
-
-    data = buf.getvalue()
-    meta["content_length"] = read if read else len(data) or meta["content_length"]
-
-    return data, meta
+        try:
+            async for chunk in r.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                hasher.update(chunk)
+                read += len(chunk)
+                if read > MAX_PDF_BYTES:
+                    raise ValueError(f"PDF too large: exceeded {MAX_PDF_MB} MB cap")
+                if spill is None and read > SPOOL_MAX_BYTES:
+                    spill = tempfile.NamedTemporaryFile(prefix="pdf-", suffix=".pdf", delete=False)
+                    spill.writelines(chunks)
+                    chunks.clear()
+                if spill is not None:
+                    spill.write(chunk)
+                else:
+                    chunks.append(chunk)
+        except BaseException:
+            if spill is not None:
+                spill.close()
+                discard_pdf(spill.name)
+            raise
+
+    meta["content_length"] = read
+    if spill is not None:
+        spill.close()
+        return spill.name, hasher.hexdigest(), meta
+    return b"".join(chunks), hasher.hexdigest(), meta
+
+
+def discard_pdf(pdf: bytes | str) -> None:
+    """
+    Remove the temp file behind a spilled download; no-op for in-memory PDFs.
+    """
+    if isinstance(pdf, str):
+        try:
+            os.unlink(pdf)
+        except FileNotFoundError:
+            pass
 
 
-def extract_text(pdf_bytes: bytes) -> str:
+def open_pdf(pdf: bytes | str) -> pymupdf.Document:
     """
-    Extract text from PDF bytes using pypdf.
+    Open a downloaded PDF. Bytes are parsed in place; a spilled download is
+    read by MuPDF straight from disk, never copied through Python.
     """
-    if not pdf_bytes:
-        return ""
-    out_lines = []
     try:
-        reader = PdfReader(io.BytesIO(pdf_bytes))
-    except PdfReadError as exc:
+        if isinstance(pdf, str):
+            return pymupdf.open(pdf, filetype="pdf")
+        return pymupdf.open(stream=pdf, filetype="pdf")
+    except pymupdf.FileDataError as exc:
         raise ValueError(f"Failed to read PDF: {exc}") from exc
 
-    total_pages = len(reader.pages)
-    for i, page in enumerate(reader.pages, start=1):
+
+def read_pages(doc: pymupdf.Document, start: int = 0, stop: int | None = None) -> str:
+    """
+    Text of pages [start, stop) of an open document, joined with PDF_BREAK
+    but not stripped, so ranges can be re-joined.
+    """
+    page_texts = []
+    stop = doc.page_count if stop is None else min(stop, doc.page_count)
+    for i in range(start, stop):
         try:
-            text = page.extract_text() or ""
-        except PdfReadError as exc:
-            raise ValueError(f"Failed to extract text on page {i}: {exc}") from exc
-        out_lines.append(text.rstrip())
-        if i < total_pages:
-            out_lines.append("\n\n----- PAGE BREAK -----\n\n")
-    return "\n".join(out_lines).strip()
+            text = doc.load_page(i).get_text("text")
+        except RuntimeError as exc:
+            raise ValueError(f"Failed to extract text on page {i + 1}: {exc}") from exc
+        page_texts.append(text.rstrip())
+    return PDF_BREAK.join(page_texts)
+
+
+def extract_pages(pdf: bytes | str, start: int = 0, stop: int | None = None) -> str:
+    """
+    Extract text from pages [start, stop) of a PDF using PyMuPDF (see read_pages).
+    """
+    with open_pdf(pdf) as doc:
+        return read_pages(doc, start, stop)
+
+
+def extract_text(pdf: bytes | str) -> str:
+    """
+    Extract text from a PDF (bytes or temp file path) using PyMuPDF.
+    """
+    if not pdf:
+        return ""
+    return extract_pages(pdf).strip()
+
+
+def extract_small(pdf: bytes | str) -> tuple[str | None, int]:
+    """
+    Worker-side entry point: extract the whole PDF if it has at most
+    PAGE_SPLIT_THRESHOLD pages, otherwise return (None, page_count) so the
+    caller can fan it out. Keeps all PDF parsing off the main process.
+    """
+    if not pdf:
+        return "", 0
+    with open_pdf(pdf) as doc:
+        total_pages = doc.page_count
+        if total_pages > PAGE_SPLIT_THRESHOLD and EXTRACT_WORKERS > 1:
+            return None, total_pages
+        return read_pages(doc).strip(), total_pages
 
 
-def sha256_hex(data: bytes) -> str:
-    return hashlib.sha256(data).hexdigest()
+async def extract_in_pool(extractor: ProcessPoolExecutor, pdf: bytes | str) -> str:
+    """
+    Extract text on the process pool. Documents over PAGE_SPLIT_THRESHOLD
+    pages are split into one page range per worker so a single large PDF
+    uses every core; short ones are extracted by the first worker directly.
+    """
+    loop = asyncio.get_running_loop()
+    text_out, total_pages = await loop.run_in_executor(extractor, extract_small, pdf)
+    if text_out is not None:
+        return text_out
+
+    step = -(-total_pages // EXTRACT_WORKERS)
+    parts = await asyncio.gather(
+        *(
+            loop.run_in_executor(extractor, extract_pages, pdf, start, start + step)
+            for start in range(0, total_pages, step)
+        )
+    )
+    return PDF_BREAK.join(parts).strip()
+
+
+async def extract_isolated(pdf: bytes | str) -> str:
+    """
+    Extract text in a single-use worker process, so a PDF that crashes
+    MuPDF breaks only its own pool. Used to re-run a batch after the
+    shared pool broke (see main).
+    """
+    loop = asyncio.get_running_loop()
+    px = make_extractor(max_workers=1)
+    try:
+        return await loop.run_in_executor(px, extract_text, pdf)
+    finally:
+        px.shutdown(wait=False, cancel_futures=True)
 
 
-def mark_success(
-    conn,
+def success_params(
     doc_id,
     *,
     text_out: str,
     meta: dict,
-    pdf_bytes: bytes,
     sha_digest: str,
-):
+) -> dict:
+    return {
+        "id": doc_id,
+        "raw_text": text_out,
+        "bytes": meta.get("content_length"),
+        "mime": meta.get("mime"),
+        "filename": meta.get("filename"),
+        "sha256": sha_digest,
+    }
+
+
+def mark_success(conn, params: dict):
     sql = f"""
         UPDATE {TABLE}
         SET
@@ -223,112 +431,332 @@ def mark_success(
           sha256 = :sha256
         WHERE id = :id
     """
-    conn.execute(
-        text(sql),
-        {
-            "id": doc_id,
-            "raw_text": text_out,
-            "bytes": len(pdf_bytes),
-            "mime": meta.get("mime"),
-            "filename": meta.get("filename"),
-            "sha256": sha_digest,
-        },
-    )
+    conn.execute(text(sql), params)
 
 
-def mark_failure(conn, doc_id, *, err_msg: str):
-    sql = f"""
-        UPDATE {TABLE}
+STAGING_TABLE = "pdf_batch_results"
+
+
+def write_results(conn, success_rows: list[dict], failure_rows: list[dict]):
+    """
+    Write a batch's results with one COPY into a session-local staging table
+    and one UPDATE ... FROM it, instead of shipping raw_text as SQL literals.
+    Staged rows with last_error NULL are successes; the rest are failures,
+    which bump process_attempts, record last_error and leave processed FALSE.
+    Runs under a savepoint: on error it is rolled back and the error re-raised,
+    leaving the outer batch transaction usable.
+    """
+    ok = "b.last_error IS NULL"
+    update_sql = f"""
+        UPDATE {TABLE} AS t
         SET
-          process_attempts = process_attempts + 1,
-          last_error = :err,
-          processed = FALSE
-        WHERE id = :id
+          raw_text = CASE WHEN {ok} THEN b.raw_text ELSE t.raw_text END,
+          processed = CASE WHEN {ok} THEN TRUE ELSE FALSE END,  -- failures normalize NULL to FALSE
+          processed_at = CASE WHEN {ok} THEN now() ELSE t.processed_at END,
+          process_attempts = t.process_attempts + 1,
+          last_error = b.last_error,
+          downloaded_at = CASE WHEN {ok} THEN COALESCE(t.downloaded_at, now()) ELSE t.downloaded_at END,
+          bytes = CASE WHEN {ok} THEN b.bytes ELSE t.bytes END,
+          mime = CASE WHEN {ok} THEN b.mime ELSE t.mime END,
+          filename = COALESCE(t.filename, b.filename),
+          sha256 = COALESCE(b.sha256, t.sha256)
+        FROM {STAGING_TABLE} AS b
+        WHERE t.id = b.id;
+        RELEASE SAVEPOINT write_results
     """
-    conn.execute(text(sql), {"id": doc_id, "err": err_msg[:800]})
+    raw = conn.connection.driver_connection
+    try:
+        with raw.cursor() as cur:
+            # No params, so both statements go out in one round-trip
+            cur.execute(f"""
+                SAVEPOINT write_results;
+                CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+                  id uuid PRIMARY KEY,
+                  raw_text text,
+                  bytes integer,
+                  mime text,
+                  filename text,
+                  sha256 text,
+                  last_error text
+                ) ON COMMIT DELETE ROWS
+            """)
+            with cur.copy(
+                f"COPY {STAGING_TABLE} (id, raw_text, bytes, mime, filename, sha256, last_error)"
+                " FROM STDIN (FORMAT BINARY)"
+            ) as cp:
+                cp.set_types(["uuid", "text", "int4", "text", "text", "text", "text"])
+                for row in success_rows:
+                    cp.write_row(
+                        (row["id"], row["raw_text"], row["bytes"], row["mime"],
+                         row["filename"], row["sha256"], None)
+                    )
+                for row in failure_rows:
+                    cp.write_row((row["id"], None, None, None, None, None, row["err"][:800]))
+            cur.execute(update_sql)
+    except psycopg.Error:
+        raw.execute("ROLLBACK TO SAVEPOINT write_results")
+        raise
+
+
+def drop_duplicate_shas(conn, rows: list[dict], failure_rows: list[dict]) -> list[dict]:
+    """
+    Find success rows whose sha256 would break the UNIQUE constraint, either
+    because another row already has it or because an earlier row in this
+    batch does, and move them to failure_rows. One SELECT, no savepoints.
+    Returns the rows that are still safe to write.
+    """
+    sql = f"""
+        SELECT id, sha256
+        FROM {TABLE}
+        WHERE sha256 = ANY(:shas)
+    """
+    owners = conn.execute(text(sql), {"shas": [row["sha256"] for row in rows]}).fetchall()
+    taken = {sha: doc_id for (doc_id, sha) in owners}
+
+    kept = []
+    for params in rows:
+        owner = taken.get(params["sha256"])
+        if owner is None or owner == params["id"]:
+            taken[params["sha256"]] = params["id"]
+            kept.append(params)
+            continue
+        err = f"Duplicate PDF: sha256 {params['sha256']} already stored"
+        failure_rows.append({"id": params["id"], "err": err})
+        print(f"✖ {params['id']}  {err}")
+    return kept
+
+
+def mark_success_rowwise(conn, rows: list[dict], failure_rows: list[dict]) -> list[dict]:
+    """
+    Last-resort fallback when the batched success UPDATE still fails after
+    drop_duplicate_shas: write row by row under savepoints so only the
+    offending documents are moved to failure_rows. Returns the rows written.
+    """
+    written = []
+    for params in rows:
+        try:
+            with conn.begin_nested():
+                mark_success(conn, params)
+        except IntegrityError as ie:
+            err = f"IntegrityError: {ie.orig if hasattr(ie, 'orig') else ie}"
+        except SQLAlchemyError as db_err:
+            err = f"SQLAlchemyError: {db_err}"
+        else:
+            written.append(params)
+            continue
+        failure_rows.append({"id": params["id"], "err": err})
+        print(f"✖ {params['id']}  {err}")
+    return written
+
+
+def write_batch(conn, success_rows: list[dict], failure_rows: list[dict]) -> list[dict]:
+    """
+    Persist a batch's results, normally with a single COPY + UPDATE.
+    If that fails, duplicate digests (the usual cause) are filtered out
+    in memory and the batch is retried; only if it fails again do we fall
+    back to per-row savepoints. Returns the success rows actually written.
+    """
+    try:
+        write_results(conn, success_rows, failure_rows)
+        return success_rows
+    except psycopg.Error:
+        success_rows = drop_duplicate_shas(conn, success_rows, failure_rows)
+
+    try:
+        write_results(conn, success_rows, failure_rows)
+        return success_rows
+    except psycopg.Error:
+        success_rows = mark_success_rowwise(conn, success_rows, failure_rows)
+
+    write_results(conn, [], failure_rows)
+    return success_rows
 
 
 # --------- Main ---------
-def process_once(sess: requests.Session, batch_no: int) -> tuple[int, int, int]:
+async def fetch_and_extract(
+    client: httpx.AsyncClient,
+    extractor: ProcessPoolExecutor | None,
+    sem: asyncio.Semaphore,
+    known_shas: set[str],
+    doc_id,
+    url: str,
+):
+    """
+    Download one PDF and extract its text on the process pool, skipping
+    extraction for already-stored PDFs. The semaphore slot is held until
+    extraction finishes, so at most DOWNLOAD_CONCURRENCY PDFs are held
+    (in memory or in temp files) at once, not the whole batch.
+    With extractor=None each PDF gets its own worker process, and a worker
+    crash is recorded as that document's failure.
+    Returns (doc_id, result, error, elapsed); result is
+    (text_out, meta, sha_digest) on success, otherwise error is set.
+    """
+    t0 = time.time()
+    try:
+        async with sem:
+            pdf, sha_digest, meta = await download_pdf(client, url)
+            try:
+                if sha_digest in known_shas:
+                    raise ValueError(f"Duplicate PDF: sha256 {sha_digest} already stored")
+                if extractor is None:
+                    text_out = await extract_isolated(pdf)
+                else:
+                    text_out = await extract_in_pool(extractor, pdf)
+            finally:
+                discard_pdf(pdf)
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool) and extractor is not None:
+            # The shared pool can't tell which PDF killed it; roll the batch back (see main)
+            raise
+        return doc_id, None, e, time.time() - t0
+    return doc_id, (text_out, meta, sha_digest), None, time.time() - t0
+
+
+async def download_and_extract(
+    client: httpx.AsyncClient,
+    extractor: ProcessPoolExecutor | None,
+    known_shas: set[str],
+    rows,
+):
+    """
+    Run every download in the batch on the event loop, with extraction
+    offloaded to the process pool, so many documents are in flight at once.
+    Yields fetch_and_extract results as documents finish.
+    """
+    # Without a shared pool every slot is a worker process, so cap them like the pool
+    sem = asyncio.Semaphore(DOWNLOAD_CONCURRENCY if extractor is not None else EXTRACT_WORKERS)
+    tasks = [
+        asyncio.create_task(fetch_and_extract(client, extractor, sem, known_shas, doc_id, url))
+        for (doc_id, url) in rows
+    ]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        # On an aborted batch, stop the rest and let their temp files be cleaned up
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def process_once(
+    client: httpx.AsyncClient,
+    extractor: ProcessPoolExecutor | None,
+    batch_no: int,
+) -> tuple[int, int, int]:
+    """
+    Run one batch, retrying once if its pooled connection turns out to be dead.
+    The engine skips pre-ping, so a stale connection only shows up here, on
+    fetch_batch, before any rows are claimed.
+    """
+    try:
+        return await process_batch(client, extractor, batch_no)
+    except OperationalError as exc:
+        if not exc.connection_invalidated:
+            raise
+        print(f"Stale DB connection, retrying batch {batch_no}: {exc.orig}")
+        return await process_batch(client, extractor, batch_no)
+
+
+async def process_batch(
+    client: httpx.AsyncClient,
+    extractor: ProcessPoolExecutor | None,
+    batch_no: int,
+) -> tuple[int, int, int]:
     with engine.begin() as conn:
         rows = fetch_batch(conn)
         if not rows:
             return 0, 0, 0
+        known_shas = get_known_shas(conn)
 
         print(f"Processing batch {batch_no} ({len(rows)} document(s))...")
 
-        success = 0
-        failures = 0
+        success_rows: list[dict] = []
+        failure_rows: list[dict] = []
+        elapsed = {}
 
-        for (doc_id, url) in rows:
-            t0 = time.time()
-            try:
-                pdf_bytes, meta = download_pdf(sess, url)
-                text_out = extract_text(pdf_bytes)
-                sha_digest = sha256_hex(pdf_bytes)
-            except Exception as e:
+        async for doc_id, result, e, dt in download_and_extract(client, extractor, known_shas, rows):
+            if e is not None:
                 err = f"{type(e).__name__}: {e}"
-                with conn.begin_nested():
-                    mark_failure(conn, doc_id, err_msg=err)
-                failures += 1
-                print(f"✖ {doc_id}  {err}")
-                continue
-
-            try:
-                with conn.begin_nested():
-                    mark_success(
-                        conn,
-                        doc_id,
-                        text_out=text_out,
-                        meta=meta,
-                        pdf_bytes=pdf_bytes,
-                        sha_digest=sha_digest,
-                    )
-            except IntegrityError as ie:
-                err = f"IntegrityError: {ie.orig if hasattr(ie, 'orig') else ie}"
-                with conn.begin_nested():
-                    mark_failure(conn, doc_id, err_msg=err)
-                failures += 1
-                print(f"✖ {doc_id}  {err}")
-                continue
-            except SQLAlchemyError as db_err:
-                err = f"SQLAlchemyError: {db_err}"
-                with conn.begin_nested():
-                    mark_failure(conn, doc_id, err_msg=err)
-                failures += 1
+                failure_rows.append({"id": doc_id, "err": err})
                 print(f"✖ {doc_id}  {err}")
                 continue
 
-            dt = time.time() - t0
-            success += 1
-            print(f"✔ {doc_id}  {len(text_out)} chars  {dt:.2f}s  ({meta.get('mime')})")
-
+            text_out, meta, sha_digest = result
+            success_rows.append(
+                success_params(
+                    doc_id,
+                    text_out=text_out,
+                    meta=meta,
+                    sha_digest=sha_digest,
+                )
+            )
+            elapsed[doc_id] = dt
+
+        # DB writes stay synchronous on this task so they share the batch transaction
+        success_rows = write_batch(conn, success_rows, failure_rows)
+        known_shas.update(row["sha256"] for row in success_rows)
+
+        for row in success_rows:
+            print(
+                f"✔ {row['id']}  {len(row['raw_text'])} chars  "
+                f"{elapsed[row['id']]:.2f}s  ({row['mime']})"
+            )
+
+        success = len(success_rows)
+        failures = len(failure_rows)
         print(f"Done. ✔={success} ✖={failures}")
         return len(rows), success, failures
 
 
-def main():
-    sess = make_http_session()
+def make_extractor(max_workers: int = EXTRACT_WORKERS) -> ProcessPoolExecutor:
+    # spawn rather than fork: workers must not inherit the event loop or pooled DB connections
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
 
+async def main():
     total_rows = 0
     total_success = 0
     total_failures = 0
     batch_no = 0
 
-    while True:
-        batch_no += 1
-        processed, success, failures = process_once(sess, batch_no)
-        if processed == 0:
-            if batch_no == 1:
-                print("Nothing to process. ✅")
-            break
+    extractor = make_extractor()
+    try:
+        async with make_http_client() as client:
+            while True:
+                batch_no += 1
+                try:
+                    processed, success, failures = await process_once(
+                        client, extractor, batch_no
+                    )
+                except BrokenProcessPool:
+                    # A worker died (MuPDF crash, OOM kill) and the batch rolled back
+                    # with no attempts charged. Re-run it with one process per PDF, so
+                    # the PDF that crashes is charged a failed attempt and the rest
+                    # of the batch commits as usual.
+                    extractor.shutdown(wait=False, cancel_futures=True)
+                    extractor = make_extractor()
+                    print(f"Extraction pool crashed; re-running batch {batch_no} one PDF per process...")
+                    processed, success, failures = await process_once(
+                        client, None, batch_no
+                    )
+
+                if processed == 0:
+                    if batch_no == 1:
+                        print("Nothing to process. ✅")
+                    break
 
-        total_rows += processed
-        total_success += success
-        total_failures += failures
+                total_rows += processed
+                total_success += success
+                total_failures += failures
 
-        if processed < BATCH_SIZE:
-            break
+                if processed < BATCH_SIZE:
+                    break
+    finally:
+        extractor.shutdown()
 
     if total_rows:
         print(
@@ -337,4 +765,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
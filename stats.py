@@ -43,11 +43,24 @@ def print_header(title: str):
 
 def main():
     with engine.begin() as conn:
-        # Totals
-        total = q(conn, f"SELECT count(*) FROM {TABLE}").scalar_one()
-        processed = q(conn, f"SELECT count(*) FROM {TABLE} WHERE processed = TRUE").scalar_one()
+        # Totals, queue freshness and 24h throughput in a single scan
+        overview = q(conn, f"""
+            SELECT
+              count(*)                                        AS total,
+              count(*) FILTER (WHERE processed = TRUE)        AS processed,
+              count(*) FILTER (WHERE last_error IS NOT NULL)  AS errors,
+              count(*) FILTER (
+                WHERE processed = FALSE AND now() - COALESCE(processed_at, now() - interval '100 years') <= interval '24 hours'
+              )                                               AS fresh_24h,
+              count(*) FILTER (
+                WHERE processed = TRUE AND processed_at >= now() - interval '24 hours'
+              )                                               AS thru_24
+            FROM {TABLE}
+        """).mappings().one()
+        total = overview["total"]
+        processed = overview["processed"]
         unprocessed = total - processed
-        errors = q(conn, f"SELECT count(*) FROM {TABLE} WHERE last_error IS NOT NULL").scalar_one()
+        errors = overview["errors"]
 
         print_header("Overview")
         print(f"Total documents       : {total:,}")
@@ -56,20 +69,23 @@ def main():
         print(f"With last_error       : {errors:,}")
 
         # Fresh vs stale queue (unprocessed only)
-        fresh_24h = q(conn, f"""
-            SELECT count(*) FROM {TABLE}
-            WHERE processed = FALSE AND now() - COALESCE(processed_at, now() - interval '100 years') <= interval '24 hours'
-        """).scalar_one()
-        print(f"Recently processed (≤24h): {fresh_24h:,}")
+        print(f"Recently processed (≤24h): {overview['fresh_24h']:,}")
 
-        # Attempt buckets
+        # Attempt buckets, all counted in one GROUP BY keyed on each bucket's lower bound
         print_header("Process attempts (all rows)")
+        bucket_case = " ".join(
+            f"WHEN process_attempts BETWEEN {lo} AND {hi} THEN {lo}" for lo, hi in ATTEMPT_BUCKETS
+        )
+        bucket_counts = dict(q(conn, f"""
+            SELECT CASE {bucket_case} END AS bucket, count(*) AS n
+            FROM {TABLE}
+            GROUP BY 1
+        """).fetchall())
         for lo, hi in ATTEMPT_BUCKETS:
+            c = bucket_counts.get(lo, 0)
             if lo == hi:
-                c = q(conn, f"SELECT count(*) FROM {TABLE} WHERE process_attempts = :n", n=lo).scalar_one()
                 print(f"Attempts == {lo:>2}: {c:,}")
             else:
-                c = q(conn, f"SELECT count(*) FROM {TABLE} WHERE process_attempts BETWEEN :lo AND :hi", lo=lo, hi=hi).scalar_one()
                 label = f"{lo}–{hi if hi < 9999 else '∞'}"
                 print(f"Attempts {label:>5}: {c:,}")
 
@@ -79,7 +95,7 @@ def main():
             SELECT id, process_attempts, LEFT(last_error, 140) AS err, processed_at
             FROM {TABLE}
             WHERE last_error IS NOT NULL
-            ORDER BY COALESCE(processed_at, '-infinity'::timestamptz) DESC
+            ORDER BY processed_at DESC NULLS LAST
             LIMIT 10
         """).fetchall()
         if not rows:
@@ -124,11 +140,7 @@ def main():
 
         # Throughput last 24h
         print_header("Throughput (processed in last 24h)")
-        thru_24 = q(conn, f"""
-            SELECT count(*) FROM {TABLE}
-            WHERE processed = TRUE AND processed_at >= now() - interval '24 hours'
-        """).scalar_one()
-        print(f"Processed last 24h: {thru_24:,}")
+        print(f"Processed last 24h: {overview['thru_24']:,}")
 
         # Oldest unprocessed (to spot stuck items)
         print_header("Oldest unprocessed (top 10 by id)")